@@ -1,11 +1,194 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import bottleneck as bn
 import time
 import re
-import base64
+import copy
+import threading
 from datetime import datetime
 from tvDatafeed import TvDatafeed, Interval
 from io import BytesIO
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from numba import njit
+
+
+# --- TARGET EVALUATION ---
+# Slots of the per-symbol result counts vector
+RESULT_KEYS = ["<=5_days", "5_to_10_days", "10_to_20_days", "20_to_30_days", ">30_days", "Never Hit", "Overlapping"]
+
+
+@njit(cache=True)
+def first_target_hits(highs, entry_pos, targets):
+    # Position of the first bar after each entry whose high reaches its target, -1 if never reached
+    n = len(highs)
+    # Highest high from each bar onwards, so unreachable targets are rejected without scanning
+    future_max = np.empty(n + 1, dtype=highs.dtype)
+    future_max[n] = -np.inf
+    for j in range(n - 1, -1, -1):
+        future_max[j] = highs[j] if highs[j] > future_max[j + 1] else future_max[j + 1]
+
+    hit_pos = np.full(len(entry_pos), -1, dtype=np.int64)
+    for k in range(len(entry_pos)):
+        if future_max[entry_pos[k] + 1] < targets[k]:
+            continue
+        for j in range(entry_pos[k] + 1, n):
+            if highs[j] >= targets[k]:
+                hit_pos[k] = j
+                break
+    return hit_pos
+
+
+# --- INDICATORS ---
+# Same parameters as TA-Lib's STOCH (SMA smoothing), RSI and SMA; the kernels below keep flat
+# windows NaN where TA-Lib reports 0, so they never signal an entry
+STOCH_FASTK_PERIOD, STOCH_SLOWK_PERIOD, STOCH_SLOWD_PERIOD = 4, 3, 3
+RSI_PERIOD = 2
+DMA_PERIOD = 200
+
+_workspace = threading.local()
+
+
+def indicator_workspace(n):
+    # Scratch rows for the indicator math, one set per worker thread, reused across symbols
+    if getattr(_workspace, 'n', None) != n:
+        _workspace.n = n
+        _workspace.values = np.empty((2, n))
+        _workspace.mask = np.empty(n, dtype=bool)
+    return _workspace.values, _workspace.mask
+
+
+@njit(cache=True)
+def wilder_rsi(close, period, out):
+    # Wilder's RSI in one pass: seed with the mean of the first `period` moves, then smooth by 1/period
+    out[:] = np.nan
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(1, len(close)):
+        delta = close[i] - close[i - 1]
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        if i <= period:
+            avg_gain += gain / period
+            avg_loss += loss / period
+        else:
+            avg_gain = (avg_gain * (period - 1) + gain) / period
+            avg_loss = (avg_loss * (period - 1) + loss) / period
+        if i >= period:
+            if avg_loss > 0:
+                out[i] = 100 - 100 / (1 + avg_gain / avg_loss)
+            elif avg_gain > 0:
+                out[i] = 100.0
+    return out
+
+
+@njit(cache=True)
+def stochastic_raw_k(close, low_min, high_max, out):
+    # Where the close sits in the window's range, in one guarded pass; a flat window gives
+    # the close no range to sit in, so it stays NaN and never signals
+    for i in range(len(close)):
+        price_range = high_max[i] - low_min[i]
+        out[i] = 100 * (close[i] - low_min[i]) / price_range if price_range != 0 else np.nan
+    return out
+
+
+@njit(cache=True)
+def entry_conditions(k, d, rsi_2, close, dma_200, out):
+    # All four entry conditions in a single pass, without intermediate boolean arrays
+    for i in range(len(close)):
+        out[i] = k[i] < 20 and d[i] < 20 and rsi_2[i] < 15 and close[i] > dma_200[i]
+    return out
+
+
+def entry_positions(df):
+    # Bars where Stochastic %K/%D and RSI(2) are oversold while price holds above the 200DMA
+    close = df['close'].to_numpy()
+    # Too few bars for a 200DMA (e.g. a recent listing): no bar can qualify, and Bottleneck
+    # rejects windows longer than the input
+    if len(close) < DMA_PERIOD:
+        return np.empty(0, dtype=np.int64)
+    (raw_k, rsi_2), mask = indicator_workspace(len(close))
+
+    low_min = bn.move_min(df['low'].to_numpy(), STOCH_FASTK_PERIOD)
+    high_max = bn.move_max(df['high'].to_numpy(), STOCH_FASTK_PERIOD)
+    stochastic_raw_k(close, low_min, high_max, raw_k)
+    k = bn.move_mean(raw_k, STOCH_SLOWK_PERIOD)
+    d = bn.move_mean(k, STOCH_SLOWD_PERIOD)
+    wilder_rsi(close, RSI_PERIOD, rsi_2)
+    dma_200 = bn.move_mean(close, DMA_PERIOD)
+
+    entry_conditions(k, d, rsi_2, close, dma_200, mask)
+    return np.flatnonzero(mask)
+
+
+# --- SCORING ---
+PCT_COLUMNS = ["<=5 days %", "5-10 days %", "10-20 days %", "20-30 days %", ">30 days %", "Never Hit %", "Overlapping %"]
+
+
+def calculate_weighted_score(pcts):
+    score = (
+        pcts[:, 0] * 0.50 +
+        pcts[:, 1] * 0.25 +
+        pcts[:, 2] * 0.125 +
+        pcts[:, 3] * 0.075 +
+        pcts[:, 4] * 0.05 -
+        pcts[:, 5] * 0.075 -
+        pcts[:, 6] * 0.10
+    )
+    return score.round(2)
+
+
+def summary_frame(stocks, totals, counts):
+    # Percentages and scores for every analysed stock, one row each, best score first
+    pcts = counts / np.maximum(totals, 1)[:, None] * 100
+    summary_df = pd.DataFrame(pcts.round(2), columns=PCT_COLUMNS)
+    summary_df.insert(0, "Stock", stocks)
+    summary_df.insert(1, "Total Trades", totals)
+    summary_df["Weighted Score"] = calculate_weighted_score(pcts)
+    return summary_df.sort_values(by="Weighted Score", ascending=False)
+
+
+# --- DATA FETCH ---
+@st.cache_data(ttl=6 * 60 * 60, show_spinner=False)
+def fetch_hist(_tv, symbol, exchange, date_key):
+    # date_key only keys the cache so history is refetched once the trading day rolls over;
+    # TvDatafeed keeps its websocket on the instance, so each call fetches through its own copy
+    df = copy.copy(_tv).get_hist(symbol=symbol, exchange=exchange,
+                                 interval=Interval.in_daily, n_bars=1500)
+    # get_hist logs and swallows websocket errors, timeouts and rate limits, returning None;
+    # raise instead so the failure reaches the user and, unlike a return value, is not cached
+    if df is None or df.empty:
+        raise ValueError("no bars returned")
+
+    # get_hist already indexes bars by timestamp; only convert when it doesn't
+    if not isinstance(df.index, pd.DatetimeIndex):
+        df.index = pd.to_datetime(df.index)
+    df['low'] = pd.to_numeric(df['low'], errors='coerce')
+    df['high'] = pd.to_numeric(df['high'], errors='coerce')
+    df['close'] = pd.to_numeric(df['close'], errors='coerce')
+    return df[['low', 'high', 'close']]
+
+
+# --- EXCEL EXPORT ---
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+_SANITIZE_RE = re.compile(r'[^A-Za-z0-9_-]')
+
+
+def sanitize_filename(name):
+    return _SANITIZE_RE.sub('_', name)
+
+
+@st.cache_data(max_entries=100, show_spinner=False)
+def to_xlsx(sheets):
+    # xlsxwriter only streams out a new workbook, which is all we need and much cheaper than openpyxl;
+    # cached so repeated downloads of the same sheets skip the GIL-bound XML serialisation
+    buffer = BytesIO()
+    with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
+        for sheet_name, frame in sheets.items():
+            frame.to_excel(writer, sheet_name=sheet_name, index=False)
+    return buffer.getvalue()
+
 
 # --- LOGIN SECTION ---
 username = st.text_input("Enter TradingView Username/Email")
@@ -23,7 +206,8 @@ st.title("📊 Stock Stochastic Trade Analyzer")
 st.markdown("Analyze stocks with stochastic, RSI, and weighted scoring.")
 
 symbols_input = st.text_area("Enter stock symbols (comma separated):", "AVALON, BLISSGVS, GALLANTT")
-symbols = [s.strip() for s in symbols_input.split(",") if s.strip()]
+# Symbols key the per-stock downloads, so drop repeats
+symbols = list(dict.fromkeys(s.strip() for s in symbols_input.split(",") if s.strip()))
 exchange = st.selectbox("Select Exchange", ["NSE", "BSE"], index=0)
 
 if st.button("Run Analysis"):
@@ -31,176 +215,106 @@ if st.button("Run Analysis"):
         st.error("⚠️ Please login first!")
     else:
         tv = st.session_state.tv
-        summary = []
+        st.session_state.pop("analysis", None)
+        # One row per symbol, filled as analyses complete and turned into the summary in one go
+        totals = np.zeros(len(symbols), dtype=np.int64)
+        counts = np.zeros((len(symbols), len(RESULT_KEYS)), dtype=np.int64)
+        analyzed = np.zeros(len(symbols), dtype=bool)
         trade_logs = {}  # store per-stock trades
         today = datetime.today().strftime('%Y-%m-%d')
 
-        def evaluate_targets(df, entries):
-            results = {"<=5_days": 0, "5_to_10_days": 0, "10_to_20_days": 0,
-                       "20_to_30_days": 0, ">30_days": 0, "Never Hit": 0, "Overlapping": 0}
-            trades_list = []
-
-            open_trade_pending = None
-            for _, row in entries.iterrows():
-                entry_date = row['datetime']
-                entry_close = row['close']
-                target_price = round(1.05 * entry_close, 2)
-                future_data = df[df['datetime'] > entry_date]
-                hit_target = future_data[future_data['high'] >= target_price]
-
-                overlap_status = "No"
-                if open_trade_pending is not None and entry_date > open_trade_pending:
-                    results["Overlapping"] += 1
-                    overlap_status = "Yes"
-
-                if not hit_target.empty:
-                    first_hit_date = hit_target.iloc[0]['datetime']
-                    holding_days = (first_hit_date - entry_date).days
-                    exit_hit_price = hit_target.iloc[0]['high']
-                    if holding_days <= 5:
-                        results["<=5_days"] += 1
-                    elif holding_days <= 10:
-                        results["5_to_10_days"] += 1
-                    elif holding_days <= 20:
-                        results["10_to_20_days"] += 1
-                    elif holding_days <= 30:
-                        results["20_to_30_days"] += 1
-                    else:
-                        results[">30_days"] += 1
-
-                    trades_list.append({
-                        "Entry Date": entry_date,
-                        "Entry Price": entry_close,
-                        "Exit Date": first_hit_date,
-                        "Exit Hit Price": exit_hit_price,
-                        "Outcome": "Target Hit",
-                        "Holding Days": holding_days,
-                        "Overlap Status": overlap_status
-                    })
-
-                else:
-                    if open_trade_pending is None:
-                        open_trade_pending = entry_date
-                    results["Never Hit"] += 1
-                    trades_list.append({
-                        "Entry Date": entry_date,
-                        "Entry Price": entry_close,
-                        "Exit Date": None,
-                        "Exit Hit Price": None,
-                        "Outcome": "Open Trade",
-                        "Holding Days": None,
-                        "Overlap Status": overlap_status
-                    })
-
-            return results, trades_list
-
-        def calculate_weighted_score(results, total_trades):
-            if total_trades == 0:
-                return 0.0
-            def pct(x): return (x / total_trades) * 100
-            score = (
-                pct(results["<=5_days"]) * 0.50 +
-                pct(results["5_to_10_days"]) * 0.25 +
-                pct(results["10_to_20_days"]) * 0.125 +
-                pct(results["20_to_30_days"]) * 0.075 +
-                pct(results[">30_days"]) * 0.05 -
-                pct(results["Never Hit"]) * 0.075 -
-                pct(results["Overlapping"]) * 0.10
-            )
-            return round(score, 2)
+        def evaluate_targets(df, entry_pos):
+            dates = df.index.to_numpy()
+            days = dates.astype('datetime64[D]').astype(np.int64)
+            highs = df['high'].to_numpy()
+            entry_dates = dates[entry_pos]
+            entry_closes = df['close'].to_numpy()[entry_pos]
+            targets = np.round(1.05 * entry_closes, 2)
 
+            hit_pos = first_target_hits(highs, entry_pos, targets)
+            hit = hit_pos >= 0
+            holding_days = np.where(hit, days[hit_pos] - days[entry_pos], -1)
+
+            # Every entry after the first unresolved trade overlaps it
+            overlap = np.zeros(len(entry_pos), dtype=bool)
+            if not hit.all():
+                overlap = entry_dates > entry_dates[np.argmin(hit)]
+
+            # Bin 0 takes the -1 "never hit" sentinel; rotate it behind the holding-day buckets
+            bucket_counts = np.bincount(np.digitize(holding_days, [0, 6, 11, 21, 31]), minlength=6)
+            results = np.append(np.roll(bucket_counts, -1), overlap.sum())
+
+            trades = pd.DataFrame({
+                "Entry Date": entry_dates,
+                "Entry Price": entry_closes,
+                "Exit Date": np.where(hit, dates[hit_pos], np.datetime64('NaT')),
+                "Exit Hit Price": np.where(hit, highs[hit_pos], np.nan),
+                "Outcome": np.where(hit, "Target Hit", "Open Trade"),
+                "Holding Days": np.where(hit, holding_days, np.nan),
+                "Overlap Status": np.where(overlap, "Yes", "No")
+            })
+
+            return results, trades
+
+        def analyze(symbol):
+            df = fetch_hist(tv, symbol, exchange, today)
+
+            entry_pos = entry_positions(df)
+            total_trades = len(entry_pos)
+            results, trades = evaluate_targets(df, entry_pos)
+
+            return total_trades, results, trades
+
+        # Fetches are network-bound, so overlap them; Streamlit calls stay on this thread
         progress = st.progress(0)
-        for i, symbol in enumerate(symbols, start=1):
-            try:
-                df = tv.get_hist(symbol=symbol, exchange=exchange,
-                                 interval=Interval.in_daily, n_bars=1500)
-                if df is None or df.empty:
-                    continue
-
-                df['datetime'] = pd.to_datetime(df.index)
-                df['low'] = pd.to_numeric(df['low'], errors='coerce')
-                df['high'] = pd.to_numeric(df['high'], errors='coerce')
-                df['close'] = pd.to_numeric(df['close'], errors='coerce')
-
-                # Indicators
-                low_min = df['low'].rolling(window=4).min()
-                high_max = df['high'].rolling(window=4).max()
-                raw_k = 100 * (df['close'] - low_min) / (high_max - low_min)
-                df['%K'] = raw_k.rolling(window=3).mean()
-                df['%D'] = df['%K'].rolling(window=3).mean()
-
-                delta = df['close'].diff()
-                gain = delta.where(delta > 0, 0)
-                loss = -delta.where(delta < 0, 0)
-                avg_gain = gain.rolling(window=2).mean()
-                avg_loss = loss.rolling(window=2).mean()
-                rs = avg_gain / avg_loss
-                df['RSI_2'] = 100 - (100 / (1 + rs))
-                df['200DMA'] = df['close'].rolling(window=200).mean()
-
-                # Entry condition
-                entries = df[(df['%K'] < 20) & (df['%D'] < 20) &
-                             (df['RSI_2'] < 15) & (df['close'] > df['200DMA'])].copy()
-                total_trades = len(entries)
-                results, trades_list = evaluate_targets(df, entries)
-
-                def pct(x): return (x / total_trades * 100) if total_trades > 0 else 0
-
-                score = calculate_weighted_score(results, total_trades)
-
-                summary.append({
-                    "Stock": symbol,
-                    "Total Trades": total_trades,
-                    "<=5 days %": round(pct(results["<=5_days"]), 2),
-                    "5-10 days %": round(pct(results["5_to_10_days"]), 2),
-                    "10-20 days %": round(pct(results["10_to_20_days"]), 2),
-                    "20-30 days %": round(pct(results["20_to_30_days"]), 2),
-                    ">30 days %": round(pct(results[">30_days"]), 2),
-                    "Never Hit %": round(pct(results["Never Hit"]), 2),
-                    "Overlapping %": round(pct(results["Overlapping"]), 2),
-                    "Weighted Score": score
-                })
-
-                trade_logs[symbol] = (results, trades_list)
-
-            except Exception as e:
-                st.error(f"Error fetching {symbol}: {e}")
-            progress.progress(i / len(symbols))
-
-        if summary:
-            summary_df = pd.DataFrame(summary).sort_values(by="Weighted Score", ascending=False)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {executor.submit(analyze, symbol): row for row, symbol in enumerate(symbols)}
+            for i, future in enumerate(as_completed(futures), start=1):
+                row = futures[future]
+                symbol = symbols[row]
+                try:
+                    totals[row], counts[row], trade_logs[symbol] = future.result()
+                    analyzed[row] = True
+                except Exception as e:
+                    st.error(f"Error fetching {symbol}: {e}")
+                progress.progress(i / len(symbols))
+
+        if analyzed.any():
+            summary_df = summary_frame(np.array(symbols)[analyzed], totals[analyzed], counts[analyzed])
             st.success("✅ Analysis Complete")
+            # Keep results across the reruns triggered by later widget interactions
+            st.session_state.analysis = (summary_df, trade_logs, today)
+
+# --- RESULTS ---
+if "analysis" in st.session_state:
+    summary_df, trade_logs, today = st.session_state.analysis
+    # Arrow-backed grid; formatting happens client-side instead of in Python-built HTML
+    st.dataframe(
+        summary_df,
+        hide_index=True,
+        column_config={
+            **{column: st.column_config.NumberColumn(format="%.2f%%") for column in PCT_COLUMNS},
+            "Weighted Score": st.column_config.NumberColumn(format="%.2f")
+        }
+    )
+
+    # Workbooks are only built when their button is clicked
+    for i, stock in enumerate(summary_df["Stock"]):
+        trades = trade_logs[stock]
+        st.download_button(
+            label=f"📥 {stock}",
+            data=partial(to_xlsx, {"Summary": summary_df.iloc[[i]], "Trades": trades}),
+            file_name=f"{sanitize_filename(stock)}_trades_{today}.xlsx",
+            mime=XLSX_MIME,
+            key=f"download_{stock}",
+            on_click="ignore"
+        )
 
-            # Add download links as a new column
-            download_links = []
-            for idx, row in summary_df.iterrows():
-                stock = row["Stock"]
-                results, trades_list = trade_logs[stock]
-
-                buffer = BytesIO()
-                with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-                    pd.DataFrame([row]).to_excel(writer, sheet_name="Summary", index=False)
-                    pd.DataFrame(trades_list).to_excel(writer, sheet_name="Trades", index=False)
-                buffer.seek(0)
-
-                b64 = base64.b64encode(buffer.read()).decode()
-                href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{stock}_trades_{today}.xlsx">📥 Download</a>'
-                download_links.append(href)
-
-            summary_df["Download"] = download_links
-
-            # Show table with clickable links
-            st.markdown(summary_df.to_html(escape=False, index=False), unsafe_allow_html=True)
-
-            # ✅ Master Excel export
-            buffer = BytesIO()
-            with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-                summary_df.drop(columns=["Download"]).to_excel(writer, index=False, sheet_name="All Stocks Summary")
-            buffer.seek(0)
-
-            st.download_button(
-                label="📥 Download All Results as Excel",
-                data=buffer,
-                file_name=f"stock_summary_{today}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+    # ✅ Master Excel export
+    st.download_button(
+        label="📥 Download All Results as Excel",
+        data=partial(to_xlsx, {"All Stocks Summary": summary_df}),
+        file_name=f"stock_summary_{today}.xlsx",
+        mime=XLSX_MIME,
+        on_click="ignore"
+    )